@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import six
+
 try:
     from django.urls import reverse
 except ImportError:
@@ -15,3 +17,25 @@ try:
     from base64 import b64decode as decode_base64
 except (ImportError, AttributeError):
     from base64 import decodestring as decode_base64
+
+try:
+    import orjson
+
+    def json_loads(value):
+        # orjson only accepts exact `str` instances, not subclasses (e.g. jsonfield's JSONString)
+        if isinstance(value, six.text_type):
+            value = six.text_type(value)
+        return orjson.loads(value)
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    import json
+
+    json_loads = json.loads
+    json_dumps = json.dumps
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
@@ -11,3 +11,9 @@ class Conflict(APIException):
     status_code = status.HTTP_409_CONFLICT
     default_detail = _('Conflict.')
     default_code = 'conflict'
+
+
+class ChecksumMismatch(APIException):
+    status_code = 460
+    default_detail = _('Checksum Mismatch.')
+    default_code = 'checksum_mismatch'
@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 import collections
+import hashlib
 import os
 import tempfile
 import uuid
@@ -14,7 +15,8 @@ from jsonfield import JSONField
 
 from rest_framework_tus import signals
 from rest_framework_tus import states
-from rest_framework_tus.utils import write_bytes_to_file
+from rest_framework_tus.exceptions import ChecksumMismatch
+from rest_framework_tus.utils import write_bytes_to_file, write_stream_to_file, checksum_matches
 
 
 class AbstractUpload(models.Model):
@@ -44,8 +46,28 @@ class AbstractUpload(models.Model):
         if self.upload_offset < 0:
             raise ValidationError(_('upload_offset should be >= 0.'))
 
-    def write_data(self, bytes, chunk_size):
-        num_bytes_written = write_bytes_to_file(self.temporary_file_path, self.upload_offset, bytes, makedirs=True)
+    def write_data(self, data, chunk_size, checksum=None):
+        """
+        Writes a chunk to the temporary file at the current upload offset
+
+        :param data: The chunk, either as bytes or as a readable file-like object (which is streamed to disk)
+        :param int chunk_size: The size of the chunk, in bytes
+        :param checksum: Optional (algorithm, hex-checksum) pair the chunk has to match
+        :raises ChecksumMismatch: When the chunk doesn't match the given checksum. The upload offset is left untouched.
+        """
+        if hasattr(data, 'read'):
+            hasher = hashlib.new(checksum[0]) if checksum is not None else None
+            num_bytes_written = write_stream_to_file(
+                self.temporary_file_path, self.upload_offset, data, chunk_size, makedirs=True, hasher=hasher)
+
+            if hasher is not None and hasher.hexdigest() != checksum[1]:
+                # Discard the chunk that has already been written
+                os.truncate(self.temporary_file_path, self.upload_offset)
+                raise ChecksumMismatch
+        else:
+            if checksum is not None and not checksum_matches(checksum[0], checksum[1], data):
+                raise ChecksumMismatch
+            num_bytes_written = write_bytes_to_file(self.temporary_file_path, self.upload_offset, data, makedirs=True)
 
         if num_bytes_written > 0:
             self.upload_offset += num_bytes_written
@@ -8,4 +8,5 @@ class TusUploadStreamParser(BaseParser):
     media_type = 'application/offset+octet-stream'
 
     def parse(self, stream, media_type=None, parser_context=None):
-        return DataAndFiles({'chunk': stream.body}, {})
+        # Hand over the stream itself, so the chunk can be written to disk without buffering it in memory
+        return DataAndFiles({'chunk': stream}, {})
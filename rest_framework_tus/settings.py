@@ -19,3 +19,4 @@ TUS_SAVE_HANDLER_CLASS = \
     REST_FRAMEWORK_TUS.get('SAVE_HANDLER_CLASS', 'rest_framework_tus.storage.DefaultSaveHandler')
 TUS_MAX_FILE_SIZE = REST_FRAMEWORK_TUS.get('MAX_FILE_SIZE', 4294967296)  # in bytes
 TUS_FILENAME_METADATA_FIELD = REST_FRAMEWORK_TUS.get('FILENAME_METADATA_FIELD', 'filename')
+TUS_RECEIVED_ASYNC = REST_FRAMEWORK_TUS.get('RECEIVED_ASYNC', False)
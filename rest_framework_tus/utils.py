@@ -4,11 +4,18 @@ from __future__ import unicode_literals
 import os
 import six
 import sys
+import threading
 
 import tempfile
 import hashlib
 
-from .compat import encode_base64
+from .compat import encode_base64, json_loads, simdjson
+
+# Amount of bytes read from a request stream at once when writing chunks
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# simdjson parsers are not thread-safe, so keep one per thread
+_simdjson_local = threading.local()
 
 
 def encode_base64_to_string(data):
@@ -32,7 +39,7 @@ def encode_upload_metadata(upload_metadata):
     """
     Encodes upload metadata according to the TUS 1.0.0 spec (http://tus.io/protocols/resumable-upload.html#creation)
 
-    :param dict upload_metadata:
+    :param collections.abc.Mapping upload_metadata:
     :return str:
     """
     # Prepare encoded data
@@ -43,6 +50,26 @@ def encode_upload_metadata(upload_metadata):
     return ','.join([' '.join([key, encoded_value]) for key, encoded_value in encoded_data])
 
 
+def load_upload_metadata(data):
+    """
+    Parses stored (JSON) upload metadata, using simdjson when it is installed
+
+    :param six.text_type|six.binary_type data:
+    :return dict:
+    """
+    if simdjson is None:
+        return json_loads(data)
+
+    parser = getattr(_simdjson_local, 'parser', None)
+    if parser is None:
+        parser = _simdjson_local.parser = simdjson.Parser()
+
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+
+    return parser.parse(data).as_dict()
+
+
 def write_bytes_to_file(file_path, offset, bytes, makedirs=False):
     """
     Util to write bytes to a local file at a specific offset
@@ -78,6 +105,67 @@ def write_bytes_to_file(file_path, offset, bytes, makedirs=False):
     return num_bytes_written
 
 
+def write_stream_to_file(file_path, offset, stream, length, makedirs=False, buffer_size=DEFAULT_BUFFER_SIZE,
+                         hasher=None):
+    """
+    Util to copy (at most) `length` bytes from a file-like object to a local file at a specific offset, without
+      reading the whole stream into memory
+
+    :param str file_path:
+    :param int offset:
+    :param stream: A readable file-like object
+    :param int length: The maximum amount of bytes to read from the stream
+    :param bool makedirs: Whether or not to create the file_path's directories if they don't exist
+    :param int buffer_size: The maximum amount of bytes to read from the stream at once
+    :param hasher: Optional hashlib object that is updated with the written bytes, in the same pass
+    :return int: The amount of bytes written
+    """
+    if makedirs:
+        if not os.path.isdir(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+
+    num_bytes_written = 0
+
+    fd = os.open(file_path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        while num_bytes_written < length:
+            data = stream.read(min(buffer_size, length - num_bytes_written))
+            if not data:
+                break
+            if hasher is not None:
+                hasher.update(data)
+            write_at(fd, offset + num_bytes_written, data)
+            num_bytes_written += len(data)
+    finally:
+        os.close(fd)
+
+    return num_bytes_written
+
+
+def _pwrite(fd, data, offset):
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.write(fd, data)
+
+
+# Positional writes save a seek for every write, where available
+pwrite = getattr(os, 'pwrite', _pwrite)
+
+
+def write_at(fd, offset, data):
+    """
+    Writes all bytes to an open file descriptor at a specific offset
+
+    :param int fd:
+    :param int offset:
+    :param data: bytes-like object
+    """
+    view = memoryview(data)
+    while view:
+        num_bytes_written = pwrite(fd, view, offset)
+        view = view[num_bytes_written:]
+        offset += num_bytes_written
+
+
 def read_bytes_from_field_file(field_file):
     """
     Returns the bytes read from a FieldFile
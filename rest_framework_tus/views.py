@@ -1,65 +1,189 @@
-# -*- coding: utf-8 -*-
-from __future__ import unicode_literals
-
-import json
 import logging
-
-from django.http import Http404
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone as dt_timezone
+from email.utils import format_datetime
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+from django.db import connections as db_connections, transaction
+from django.urls import get_script_prefix, get_urlconf
 from django.utils import timezone
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import get_language
 from rest_framework import mixins, status
-from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.exceptions import MethodNotAllowed, UnsupportedMediaType
 from rest_framework.metadata import BaseMetadata
 from rest_framework.response import Response
+from rest_framework.utils.mediatypes import media_type_matches
 from rest_framework.viewsets import GenericViewSet
 
 from rest_framework_tus.parsers import TusUploadStreamParser
 from . import tus_api_version, tus_api_version_supported, tus_api_extensions, tus_api_checksum_algorithms, \
     settings as tus_settings, constants, signals, states
-from .compat import reverse
-from .exceptions import Conflict
+from .compat import reverse, json_dumps
+from .exceptions import Conflict, ChecksumMismatch
 from .models import get_upload_model
 from .serializers import UploadSerializer
-from .utils import encode_upload_metadata, checksum_matches
+from .utils import encode_upload_metadata, load_upload_metadata, checksum_matches
 
 logger = logging.getLogger(__name__)
 
+utc = dt_timezone.utc
+
+# Sends the "received" signal outside of the request when RECEIVED_ASYNC is enabled
+received_executor = ThreadPoolExecutor(thread_name_prefix='rest_framework_tus')
+
+# Static TUS response header values
+TUS_VERSION_HEADER = ','.join(tus_api_version_supported)
+TUS_EXTENSION_HEADER = ','.join(tus_api_extensions)
+TUS_CHECKSUM_ALGORITHM_HEADER = ','.join(tus_api_checksum_algorithms)
+
+MISSING_TUS_HEADER_MESSAGE = 'Missing "Tus-Resumable" header.'
+
+# Upload guids in URLs. Django compiles the resulting URL pattern once, when it's first used
+GUID_REGEX = '[a-zA-Z0-9]{8}-[a-zA-Z0-9]{4}-[a-zA-Z0-9]{4}-[a-zA-Z0-9]{4}-[a-zA-Z0-9]{12}'
+
+# Used to reverse the upload detail URL once (it has to match GUID_REGEX)
+URL_GUID_PLACEHOLDER = '00000000-0000-0000-0000-000000000000'
+
+
+def get_tus_value(request, name, default=None):
+    """
+    Returns a value parsed by the TusMiddleware. These are stored on the Django request, so they are looked up in
+      its __dict__ directly instead of going through DRF's Request attribute proxy.
+
+    :param request:
+    :param str name: One of the field names in `rest_framework_tus.constants`
+    :param default:
+    :return: The parsed value, or the default value if the header wasn't given
+    """
+    return getattr(request, '_request', request).__dict__.get(name, default)
+
+
+def send_received_signal(upload_pk):
+    """
+    Sends the "received" signal for the given upload from a background thread
+
+    :param upload_pk:
+    """
+    try:
+        # Use a fresh instance, the request thread may still be using its own one
+        upload = get_upload_model().objects.get(pk=upload_pk)
+
+        for receiver, response in signals.received.send_robust(sender=upload.__class__, instance=upload):
+            if isinstance(response, Exception):
+                logger.error('Receiver {} failed for upload {}'.format(receiver, upload_pk), exc_info=response)
+    except Exception:
+        # Nobody waits for the result of this thread, so make sure errors don't go unnoticed
+        logger.exception('Unable to send the received signal for upload {}'.format(upload_pk))
+    finally:
+        # Close the connections this thread opened, for any database the upload may be routed to
+        db_connections.close_all()
+
 
 def has_required_tus_header(request):
-    return hasattr(request, constants.TUS_RESUMABLE_FIELD_NAME)
+    return constants.TUS_RESUMABLE_FIELD_NAME in getattr(request, '_request', request).__dict__
+
+
+def missing_tus_header_response():
+    # Responses are mutated while being finalized and rendered (renderer, headers, content), so they can't be shared
+    #   between requests. Only the message is static.
+    return Response(MISSING_TUS_HEADER_MESSAGE, status=status.HTTP_400_BAD_REQUEST)
 
 
 def add_expiry_header(upload, headers):
     if upload.expires:
-        headers['Upload-Expires'] = upload.expires.strftime('%a, %d %b %Y %H:%M:%S %Z')
+        headers['Upload-Expires'] = format_datetime(upload.expires.astimezone(utc), usegmt=True)
+
+
+@lru_cache(maxsize=32)
+def get_tus_metadata(max_file_size):
+    """
+    Builds the (static) OPTIONS response data once per max file size
+
+    :param int max_file_size:
+    :return dict:
+    """
+    return {
+        'Tus-Resumable': tus_api_version,
+        'Tus-Version': TUS_VERSION_HEADER,
+        'Tus-Extension': TUS_EXTENSION_HEADER,
+        'Tus-Max-Size': max_file_size,
+        'Tus-Checksum-Algorithm': TUS_CHECKSUM_ALGORITHM_HEADER,
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'PATCH,HEAD,GET,POST,OPTIONS',
+        'Access-Control-Expose-Headers': 'Tus-Resumable,upload-length,upload-metadata,Location,Upload-Offset',
+        'Access-Control-Allow-Headers':
+            'Tus-Resumable,upload-length,upload-metadata,Location,Upload-Offset,content-type',
+        'Cache-Control': 'no-store'
+    }
+
+
+@lru_cache(maxsize=256)
+def get_upload_metadata_header(upload_metadata):
+    """
+    Converts stored (JSON) upload metadata into its "Upload-Metadata" header value. Memoized, since clients keep
+      polling HEAD for the same upload while resuming.
+
+    :param six.text_type upload_metadata:
+    :return str:
+    """
+    return encode_upload_metadata(load_upload_metadata(upload_metadata))
+
+
+@lru_cache(maxsize=32)
+def get_upload_detail_url_parts(script_prefix, urlconf, language):
+    """
+    Reverses the upload detail URL once (per script prefix, urlconf and active language, e.g. for i18n_patterns), and
+      splits it around the guid, so the Location of new uploads can be built without going through the URL resolver.
+
+    :param str script_prefix:
+    :param urlconf:
+    :param str language: The active language, only used as part of the cache key
+    :return tuple: The (prefix, suffix) pair, or None if the URL could not be split
+    """
+    url = reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': URL_GUID_PLACEHOLDER}, urlconf=urlconf)
+    if url.count(URL_GUID_PLACEHOLDER) != 1:
+        return None
+    prefix, suffix = url.split(URL_GUID_PLACEHOLDER)
+    return prefix, suffix
 
 
 class UploadMetadata(BaseMetadata):
     def determine_metadata(self, request, view):
-        return {
-            'Tus-Resumable': tus_api_version,
-            'Tus-Version': ','.join(tus_api_version_supported),
-            'Tus-Extension': ','.join(tus_api_extensions),
-            'Tus-Max-Size': getattr(view, 'max_file_size', tus_settings.TUS_MAX_FILE_SIZE),
-            'Tus-Checksum-Algorithm': ','.join(tus_api_checksum_algorithms),
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'PATCH,HEAD,GET,POST,OPTIONS',
-            'Access-Control-Expose-Headers': 'Tus-Resumable,upload-length,upload-metadata,Location,Upload-Offset',
-            'Access-Control-Allow-Headers':
-                'Tus-Resumable,upload-length,upload-metadata,Location,Upload-Offset,content-type',
-            'Cache-Control': 'no-store'
-        }
+        # Return a copy, subclasses may extend the data
+        return dict(get_tus_metadata(getattr(view, 'max_file_size', tus_settings.TUS_MAX_FILE_SIZE)))
 
 
 class TusHeadMixin(object):
+    def get_object_or_none(self):
+        """
+        Same as `get_object`, but returns None instead of raising Http404 when the upload doesn't exist (which is common
+          for HEAD requests, e.g. when clients probe whether an upload can be resumed).
+
+        :return: The upload, or None
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            upload = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}).first()
+        except (TypeError, ValueError, ValidationError):
+            # Same as DRF's get_object_or_404, e.g. for guids that match the lookup_value_regex but aren't valid UUIDs
+            return None
+
+        if upload is not None:
+            # May raise a permission denied
+            self.check_object_permissions(self.request, upload)
+
+        return upload
+
     def info(self, request, *args, **kwargs):
         # Validate tus header
         if not has_required_tus_header(request):
-            return Response('Missing "{}" header.'.format('Tus-Resumable'), status=status.HTTP_400_BAD_REQUEST)
+            return missing_tus_header_response()
 
-        try:
-            upload = self.get_object()
-        except Http404:
+        upload = self.get_object_or_none()
+        if upload is None:
             # Instead of simply trowing a 404, we need to add a cache-control header to the response
             return Response('Not found.', headers={'Cache-Control': 'no-store'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -72,7 +196,7 @@ class TusHeadMixin(object):
             headers['Upload-Length'] = upload.upload_length
 
         if upload.upload_metadata:
-            headers['Upload-Metadata'] = encode_upload_metadata(json.loads(upload.upload_metadata))
+            headers['Upload-Metadata'] = get_upload_metadata_header(upload.upload_metadata)
 
         # Add upload expiry to headers
         add_expiry_header(upload, headers)
@@ -84,10 +208,10 @@ class TusCreateMixin(mixins.CreateModelMixin):
     def create(self, request, *args, **kwargs):
         # Validate tus header
         if not has_required_tus_header(request):
-            return Response('Missing "{}" header.'.format('Tus-Resumable'), status=status.HTTP_400_BAD_REQUEST)
+            return missing_tus_header_response()
 
         # Get file size from request
-        upload_length = getattr(request, constants.UPLOAD_LENGTH_FIELD_NAME, -1)
+        upload_length = get_tus_value(request, constants.UPLOAD_LENGTH_FIELD_NAME, -1)
 
         # Validate upload_length
         max_file_size = getattr(self, 'max_file_size', tus_settings.TUS_MAX_FILE_SIZE)
@@ -97,11 +221,11 @@ class TusCreateMixin(mixins.CreateModelMixin):
 
         # If upload_length is not given, we expect the defer header!
         if not upload_length or upload_length < 0:
-            if getattr(request, constants.UPLOAD_DEFER_LENGTH_FIELD_NAME, -1) != 1:
+            if get_tus_value(request, constants.UPLOAD_DEFER_LENGTH_FIELD_NAME, -1) != 1:
                 return Response('Missing "{Upload-Defer-Length}" header.', status=status.HTTP_400_BAD_REQUEST)
 
         # Get metadata from request
-        upload_metadata = getattr(request, constants.UPLOAD_METADATA_FIELD_NAME, {})
+        upload_metadata = get_tus_value(request, constants.UPLOAD_METADATA_FIELD_NAME, {})
 
         # Get data from metadata
         filename = upload_metadata.get(tus_settings.TUS_FILENAME_METADATA_FIELD, '')
@@ -119,24 +243,20 @@ class TusCreateMixin(mixins.CreateModelMixin):
         # Validate serializer
         serializer.is_valid(raise_exception=True)
 
+        # Add the extra fields to the validated data, so they're saved even when "perform_create" is overridden
+        serializer.validated_data.update(self.get_create_kwargs(request))
+
         # Create upload object
         self.perform_create(serializer)
 
         # Get upload from serializer
         upload = serializer.instance
 
-        # Set the user if the upload has a user field
-        if request.user.is_authenticated and hasattr(upload, 'user'):
-            upload.user = request.user
-            upload.save()
-
-        # Prepare response headers
-        headers = self.get_success_headers(serializer.data)
-
-        # Maybe we're auto-expiring the upload...
-        if tus_settings.TUS_UPLOAD_EXPIRES is not None:
-            upload.expires = timezone.now() + tus_settings.TUS_UPLOAD_EXPIRES
-            upload.save()
+        # Prepare response headers (only render the serializer data when it's included in the response body)
+        if tus_settings.TUS_RESPONSE_BODY_ENABLED:
+            headers = self.get_success_headers(serializer.data)
+        else:
+            headers = self.get_success_headers({'guid': upload.guid})
 
         # Add upload expiry to headers
         add_expiry_header(upload, headers)
@@ -150,19 +270,44 @@ class TusCreateMixin(mixins.CreateModelMixin):
 
         return Response(serializer.data, headers=headers, status=status.HTTP_201_CREATED)
 
+    def get_create_kwargs(self, request):
+        """
+        Returns the extra fields to set when creating an upload, so they are included in the INSERT instead of
+          updating the upload right after creating it.
+
+        :param request:
+        :return dict:
+        """
+        create_kwargs = {}
+
+        # Maybe we're auto-expiring the upload...
+        if tus_settings.TUS_UPLOAD_EXPIRES is not None:
+            create_kwargs['expires'] = timezone.now() + tus_settings.TUS_UPLOAD_EXPIRES
+
+        # Set the user if the upload has a user field
+        if request.user.is_authenticated and hasattr(get_upload_model(), 'user'):
+            create_kwargs['user'] = request.user
+
+        return create_kwargs
+
     def get_serializer_data(self, request, metadata, file_length, filename):
         return {
             'upload_length': file_length,
-            'upload_metadata': json.dumps(metadata),
+            'upload_metadata': json_dumps(metadata),
             'filename': filename,
         }
 
     def get_success_headers(self, data):
         try:
-            return {'Location': reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': data['guid']})}
+            guid = data['guid']
         except (TypeError, KeyError):
             return {}
 
+        url_parts = get_upload_detail_url_parts(get_script_prefix(), get_urlconf(), get_language())
+        if url_parts is None:
+            return {'Location': reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': guid})}
+        return {'Location': '{}{}{}'.format(url_parts[0], guid, url_parts[1])}
+
     def validate_success_headers(self, headers):
         """
         Handler to validate success headers before the response is sent. Should throw a ValidationError if
@@ -184,15 +329,48 @@ class TusCreateMixin(mixins.CreateModelMixin):
 
 
 class TusPatchMixin(mixins.UpdateModelMixin):
+    # Whether to read chunks into memory (and run "validate_chunk" on them) instead of streaming them to disk
+    buffer_chunks = False
+
+    def uses_stream_parser(self, request):
+        """
+        Whether the request body is handled by the TusUploadStreamParser. Uses the parsers of the request, so
+          per-instance parser_classes (e.g. passed to "as_view") and "get_parsers" overrides are taken into account.
+
+        :param request:
+        :return bool:
+        """
+        parser = request.negotiator.select_parser(request, request.parsers)
+        return isinstance(parser, TusUploadStreamParser)
+
     def get_chunk(self, request):
-        if TusUploadStreamParser in self.parser_classes:
+        """
+        Returns the chunk as a readable file-like object, so it can be streamed to disk.
+
+        :param request:
+        :return: A readable file-like object
+        """
+        if self.uses_stream_parser(request):
             return request.data['chunk']
-        return request.body
+        return request.stream
+
+    def get_chunk_bytes(self, request, chunk_size):
+        """
+        Reads the complete chunk into memory. Only used when the chunk bytes are needed before writing them.
+
+        :param request:
+        :param int chunk_size:
+        :return six.binary_type: The chunk_bytes
+        """
+        chunk = self.get_chunk(request)
+        if hasattr(chunk, 'read'):
+            return chunk.read(chunk_size)
+        return chunk
 
     def validate_chunk(self, offset, chunk_bytes):
         """
         Handler to validate chunks before they are actually written to the buffer file. Should throw a ValidationError
-          if something's off.
+          if something's off. Only called when "buffer_chunks" is enabled.
 
         :param int offset:
         :param six.binary_type chunk_bytes:
@@ -200,24 +378,37 @@ class TusPatchMixin(mixins.UpdateModelMixin):
         """
         return chunk_bytes
 
+    def dispatch_received(self, upload):
+        """
+        Handler to trigger the "received" signal once all chunks have been written. When the RECEIVED_ASYNC setting is
+          enabled, the signal is sent from a background thread after the transaction commits, so slow receivers don't
+          delay the response. Override to e.g. hand the upload over to a task queue instead.
+
+        :param upload:
+        """
+        if tus_settings.TUS_RECEIVED_ASYNC:
+            upload_pk = upload.pk
+            transaction.on_commit(lambda: received_executor.submit(send_received_signal, upload_pk))
+        else:
+            signals.received.send(sender=upload.__class__, instance=upload)
+
     def update(self, request, *args, **kwargs):
         raise MethodNotAllowed
 
     def partial_update(self, request, *args, **kwargs):
         # Validate tus header
         if not has_required_tus_header(request):
-            return Response('Missing "{}" header.'.format('Tus-Resumable'), status=status.HTTP_400_BAD_REQUEST)
+            return missing_tus_header_response()
 
-        # Validate content type
+        # Validate content type, before the upload is touched
         if not self._is_valid_content_type(request):
-            return Response('Invalid value for "Content-Type" header: {}. Expected "{}".'.format(
-                request.META['CONTENT_TYPE'], TusUploadStreamParser.media_type), status=status.HTTP_400_BAD_REQUEST)
+            raise UnsupportedMediaType(request.content_type)
 
         # Retrieve object
         upload = self.get_object()
 
         # Get upload_offset
-        upload_offset = getattr(request, constants.UPLOAD_OFFSET_NAME)
+        upload_offset = get_tus_value(request, constants.UPLOAD_OFFSET_NAME)
 
         # Validate upload_offset
         if upload_offset != upload.upload_offset:
@@ -226,39 +417,51 @@ class TusPatchMixin(mixins.UpdateModelMixin):
         # Make sure there is a tempfile for the upload
         assert upload.get_or_create_temporary_file()
 
-        # Change state
+        # Change state (saved together with the new upload offset by "write_data")
         if upload.state == states.INITIAL:
             upload.start_receiving()
-            upload.save()
 
-        # Get chunk from request
-        chunk_bytes = self.get_chunk(request)
+        # Get chunk size from request
+        chunk_size = int(request.META.get('CONTENT_LENGTH') or 0)
 
         # Check for data
-        if not chunk_bytes:
+        if chunk_size <= 0:
             return Response('No data.', status=status.HTTP_400_BAD_REQUEST)
 
-        # Check checksum  (http://tus.io/protocols/resumable-upload.html#checksum)
-        upload_checksum = getattr(request, constants.UPLOAD_CHECKSUM_FIELD_NAME, None)
-        if upload_checksum is not None:
-            if upload_checksum[0] not in tus_api_checksum_algorithms:
-                return Response('Unsupported Checksum Algorithm: {}.'.format(
-                    upload_checksum[0]), status=status.HTTP_400_BAD_REQUEST)
-            elif not checksum_matches(
-                    upload_checksum[0], upload_checksum[1], chunk_bytes):
-                return Response('Checksum Mismatch.', status=460)
+        # Validate checksum algorithm  (http://tus.io/protocols/resumable-upload.html#checksum)
+        upload_checksum = get_tus_value(request, constants.UPLOAD_CHECKSUM_FIELD_NAME, None)
+        if upload_checksum is not None and upload_checksum[0] not in tus_api_checksum_algorithms:
+            return Response('Unsupported Checksum Algorithm: {}.'.format(
+                upload_checksum[0]), status=status.HTTP_400_BAD_REQUEST)
 
-        # Run chunk validator
-        chunk_bytes = self.validate_chunk(upload_offset, chunk_bytes)
+        # The chunk is streamed to disk (and checksummed while writing), unless the view needs its bytes upfront
+        if not self.buffer_chunks:
+            chunk = self.get_chunk(request)
+        else:
+            chunk = self.get_chunk_bytes(request, chunk_size)
 
-        # Check for data
-        if not chunk_bytes:
-            return Response('No data. Make sure "validate_chunk" returns data.', status=status.HTTP_400_BAD_REQUEST)
+            # Check for data
+            if not chunk:
+                return Response('No data.', status=status.HTTP_400_BAD_REQUEST)
+
+            # Check checksum before the chunk validator gets the chance to alter the chunk
+            if upload_checksum is not None:
+                if not checksum_matches(upload_checksum[0], upload_checksum[1], chunk):
+                    return Response('Checksum Mismatch.', status=460)
+                upload_checksum = None
+
+            # Run chunk validator
+            chunk = self.validate_chunk(upload_offset, chunk)
+
+            # Check for data
+            if not chunk:
+                return Response('No data. Make sure "validate_chunk" returns data.', status=status.HTTP_400_BAD_REQUEST)
 
         # Write file
-        chunk_size = int(request.META.get('CONTENT_LENGTH', 102400))
         try:
-            upload.write_data(chunk_bytes, chunk_size)
+            upload.write_data(chunk, chunk_size, checksum=upload_checksum)
+        except ChecksumMismatch:
+            return Response('Checksum Mismatch.', status=460)
         except Exception as e:
             return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
@@ -268,7 +471,7 @@ class TusPatchMixin(mixins.UpdateModelMixin):
 
         if upload.upload_length == upload.upload_offset:
             # Trigger signal
-            signals.received.send(sender=upload.__class__, instance=upload)
+            self.dispatch_received(upload)
 
         # Add upload expiry to headers
         add_expiry_header(upload, headers)
@@ -283,7 +486,7 @@ class TusPatchMixin(mixins.UpdateModelMixin):
         return Response(serializer.data, headers=headers, status=status.HTTP_204_NO_CONTENT)
 
     def _is_valid_content_type(self, request):
-        return request.META['CONTENT_TYPE'] == TusUploadStreamParser.media_type
+        return media_type_matches(TusUploadStreamParser.media_type, request.content_type)
 
 
 class TusTerminateMixin(mixins.DestroyModelMixin):
@@ -293,7 +496,8 @@ class TusTerminateMixin(mixins.DestroyModelMixin):
 
         # When the upload is still saving, we're not able to destroy the entity
         if upload.state == states.SAVING:
-            return Response(_('Unable to terminate upload while in state "{}".'.format(upload.state)),
+            from django.utils.translation import gettext as _
+            return Response(_('Unable to terminate upload while in state "{}".').format(upload.state),
                             status=status.HTTP_409_CONFLICT)
 
         # Destroy object
@@ -310,8 +514,14 @@ class UploadViewSet(TusCreateMixin,
     serializer_class = UploadSerializer
     metadata_class = UploadMetadata
     lookup_field = 'guid'
-    lookup_value_regex = '[a-zA-Z0-9]{8}-[a-zA-Z0-9]{4}-[a-zA-Z0-9]{4}-[a-zA-Z0-9]{4}-[a-zA-Z0-9]{12}'
+    lookup_value_regex = GUID_REGEX
     parser_classes = [TusUploadStreamParser]
 
     def get_queryset(self):
-        return get_upload_model().objects.all()
+        queryset = get_upload_model().objects.all()
+
+        # HEAD requests only report the upload's progress, metadata and expiry
+        if self.action == 'info':
+            queryset = queryset.only('guid', 'upload_offset', 'upload_length', 'upload_metadata', 'expires')
+
+        return queryset
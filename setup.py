@@ -64,6 +64,13 @@ setup(
         'python-dateutil>=2.0.0',
         'six>=1.11.0',
     ],
+    extras_require={
+        # Optional speedups
+        'fast': [
+            'orjson',
+            'pysimdjson',
+        ],
+    },
     license="MIT",
     zip_safe=False,
     keywords='drf-tus',
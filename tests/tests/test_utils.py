@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import io
+import os
+import tempfile
+import threading
+
+from unittest import mock
 from unittest.case import TestCase
 
-from rest_framework_tus.utils import encode_upload_metadata, encode_base64_to_string
-from rest_framework_tus.compat import decode_base64
+from jsonfield.json import JSONString
+
+from rest_framework_tus import utils
+from rest_framework_tus.utils import encode_upload_metadata, encode_base64_to_string, load_upload_metadata, \
+    write_stream_to_file, read_bytes
+from rest_framework_tus.compat import decode_base64, json_loads, json_dumps
 
 
 class UtilsTest(TestCase):
@@ -30,3 +40,60 @@ class UtilsTest(TestCase):
 
         # Check result
         assert result == 'filename {},some-key {}'.format(encode_base64_to_string('bla.jpg'), encode_base64_to_string('hallo.png'))
+
+    def test_load_upload_metadata(self):
+        data = '{"filename": "bla.jpg", "some-key": "h\u00e9llo.png"}'
+
+        # Load from text and bytes
+        assert load_upload_metadata(data) == {'filename': 'bla.jpg', 'some-key': 'h\u00e9llo.png'}
+        assert load_upload_metadata(data.encode('utf-8')) == {'filename': 'bla.jpg', 'some-key': 'h\u00e9llo.png'}
+
+    def test_load_upload_metadata_simdjson(self):
+        parser = mock.Mock()
+        parser.parse.return_value.as_dict.return_value = {'filename': 'bla.jpg'}
+        simdjson = mock.Mock(**{'Parser.return_value': parser})
+
+        with mock.patch('rest_framework_tus.utils.simdjson', simdjson), \
+                mock.patch('rest_framework_tus.utils._simdjson_local', threading.local()):
+            assert load_upload_metadata('{"filename": "bla.jpg"}') == {'filename': 'bla.jpg'}
+            assert load_upload_metadata(b'{"filename": "bla.jpg"}') == {'filename': 'bla.jpg'}
+
+        # The parser is reused within a thread, and is given bytes
+        simdjson.Parser.assert_called_once_with()
+        parser.parse.assert_has_calls([mock.call(b'{"filename": "bla.jpg"}')] * 2, any_order=True)
+
+    def test_load_upload_metadata_without_simdjson(self):
+        with mock.patch('rest_framework_tus.utils.simdjson', None):
+            assert load_upload_metadata('{"filename": "bla.jpg"}') == {'filename': 'bla.jpg'}
+
+    def test_write_stream_to_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+
+        try:
+            # Write first part, then the second part (using a tiny buffer), ignoring anything beyond the length
+            assert write_stream_to_file(path, 0, io.BytesIO(b'hello'), 5) == 5
+            assert write_stream_to_file(path, 5, io.BytesIO(b' world!!!'), 6, buffer_size=4) == 6
+
+            assert read_bytes(path) == b'hello world'
+
+            # Request streams only offer "read"
+            stream = mock.Mock(spec=['read'], read=io.BytesIO(b'HELLO').read)
+            assert write_stream_to_file(path, 0, stream, 5, buffer_size=2) == 5
+
+            assert read_bytes(path) == b'HELLO world'
+
+            # Platforms without os.pwrite seek before writing
+            with mock.patch('rest_framework_tus.utils.pwrite', utils._pwrite):
+                assert write_stream_to_file(path, 6, io.BytesIO(b'WORLD'), 5) == 5
+
+            assert read_bytes(path) == b'HELLO WORLD'
+        finally:
+            os.remove(path)
+
+    def test_json_loads(self):
+        # Values loaded by jsonfield are str subclasses, which orjson doesn't accept as such
+        data = JSONString('{"filename": "bla.jpg"}')
+
+        assert json_loads(data) == {'filename': 'bla.jpg'}
+        assert json_loads(json_dumps({'filename': 'bla.jpg'})) == {'filename': 'bla.jpg'}
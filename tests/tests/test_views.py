@@ -3,17 +3,25 @@ from __future__ import unicode_literals
 
 import copy
 import json
+import uuid
 
-from datetime import timedelta
+from datetime import timedelta, timezone as dt_timezone
+from email.utils import format_datetime
+from unittest import mock
 
-from django.utils import timezone
+from django.urls import set_urlconf
+from django.utils import timezone, translation
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.parsers import JSONParser
+from rest_framework.test import APITestCase, APIRequestFactory
 
 from rest_framework_tus import settings as tus_settings, tus_api_extensions, tus_api_version_supported, tus_api_version, \
     states
+from rest_framework_tus import views
 from rest_framework_tus.compat import reverse
+from rest_framework_tus.middleware import TusMiddleware
 from rest_framework_tus.models import get_upload_model
+from rest_framework_tus.parsers import TusUploadStreamParser
 from rest_framework_tus.utils import encode_upload_metadata, encode_base64_to_string, \
     read_bytes_from_field_file, create_checksum_header
 from tests.tests.factories import UploadFactory
@@ -46,6 +54,10 @@ class ViewTests(APITestCase):
         for key in expected:
             assert result.data[key] == expected[key]
 
+        # Make sure changes to the returned data don't leak into later requests
+        result.data['Cache-Control'] = 'max-age=60'
+        assert views.UploadMetadata().determine_metadata(None, None)['Cache-Control'] == 'no-store'
+
     def test_head_incorrect_header(self):
         # Create upload
         upload = UploadFactory()
@@ -74,7 +86,21 @@ class ViewTests(APITestCase):
         assert 'Tus-Resumable' in result
         assert int(result['Upload-Offset']) >= 0
         assert result['Upload-Metadata'] == 'filename {}'.format(encode_base64_to_string('test_file.jpg'))
-        assert result['Upload-Expires'] is not None
+        assert result['Upload-Expires'] == format_datetime(upload.expires.astimezone(dt_timezone.utc), usegmt=True)
+
+    def test_head_not_found(self):
+        # Unknown upload, and a guid matching the URL pattern that isn't a valid UUID
+        for guid in (uuid.uuid4(), 'zzzzzzzz-zzzz-zzzz-zzzz-zzzzzzzzzzzz'):
+            # Perform request
+            result = self.client.head(
+                reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': guid}),
+                headers={'Tus-Resumable': tus_api_version})
+
+            # Check status
+            assert result.status_code == status.HTTP_404_NOT_FOUND
+
+            # Validate response headers
+            assert result['Cache-Control'] == 'no-store'
 
     def test_create_without_length(self):
         # Prepare creation headers
@@ -158,12 +184,52 @@ class ViewTests(APITestCase):
         # Validate upload
         assert upload.upload_length == 100
         assert upload.filename == 'test_file.jpg'
+        assert upload.expires is not None
 
         # Validate response headers
         assert 'Tus-Resumable' in result
+        assert result['Upload-Expires'] == format_datetime(upload.expires.astimezone(dt_timezone.utc), usegmt=True)
         assert result['Location'].endswith(
             reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': upload.guid}))
 
+    def test_create_location_i18n(self):
+        guid = uuid.uuid4()
+        view = views.UploadViewSet()
+
+        set_urlconf('tests.urls_i18n')
+        try:
+            with translation.override('en'):
+                location_en = view.get_success_headers({'guid': guid})['Location']
+            with translation.override('nl'):
+                location_nl = view.get_success_headers({'guid': guid})['Location']
+        finally:
+            set_urlconf(None)
+
+        # The Location is reversed for the active language
+        assert location_en == '/en/files/{}/'.format(guid)
+        assert location_nl == '/nl/files/{}/'.format(guid)
+
+    def test_create_with_custom_perform_create(self):
+        class UploadViewSet(views.UploadViewSet):
+            def perform_create(self, serializer):
+                serializer.save(filename='custom.jpg')
+
+        # Prepare request
+        request = APIRequestFactory().post(
+            reverse('rest_framework_tus:api:upload-list'), HTTP_TUS_RESUMABLE=tus_api_version, HTTP_UPLOAD_LENGTH='100')
+        TusMiddleware().process_request(request)
+
+        # Perform request
+        result = UploadViewSet.as_view({'post': 'create'})(request)
+
+        # Check status
+        assert result.status_code == status.HTTP_201_CREATED
+
+        # The expiry is still set
+        upload = get_upload_model().objects.get()
+        assert upload.filename == 'custom.jpg'
+        assert upload.expires is not None
+
     def test_terminate_while_saving(self):
         # Create upload
         upload = UploadFactory(
@@ -206,6 +272,172 @@ class ViewTests(APITestCase):
         # Verify existence
         assert get_upload_model().objects.filter(guid=upload.guid).exists() is False
 
+    def test_upload_first_chunk(self):
+        # Create upload
+        upload = UploadFactory(
+            filename='test_data.txt', upload_metadata=json.dumps({'filename': 'test_data.txt'}), upload_length=100)
+
+        # Prepare headers
+        headers = {
+            'Tus-Resumable': tus_api_version,
+            'Upload-Offset': 0,
+        }
+
+        # Perform request
+        result = self.client.patch(
+            reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': upload.guid}), data=b'1234',
+            headers=headers, content_type='application/offset+octet-stream')
+
+        # Check result
+        assert result.status_code == status.HTTP_204_NO_CONTENT
+        assert result['Upload-Offset'] == '4'
+
+        # Make sure both the state and the offset have been saved
+        upload = get_upload_model().objects.get(guid=upload.guid)
+        assert upload.state == states.RECEIVING
+        assert upload.upload_offset == 4
+
+        # Cleanup file
+        upload.delete()
+
+    def test_upload_received_async(self):
+        # Create upload
+        upload = UploadFactory(
+            filename='test_data.txt', upload_metadata=json.dumps({'filename': 'test_data.txt'}), upload_length=4)
+
+        # Prepare headers
+        headers = {
+            'Tus-Resumable': tus_api_version,
+            'Upload-Offset': 0,
+        }
+
+        # Perform request, running the background work inline
+        with mock.patch.object(tus_settings, 'TUS_RECEIVED_ASYNC', True), \
+                mock.patch.object(views.received_executor, 'submit', side_effect=lambda fn, *args: fn(*args)), \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            result = self.client.patch(
+                reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': upload.guid}), data=b'1234',
+                headers=headers, content_type='application/offset+octet-stream')
+
+        # Check result
+        assert result.status_code == status.HTTP_204_NO_CONTENT
+        assert len(callbacks) == 1
+
+        # Assert file is ready
+        upload = get_upload_model().objects.get(guid=upload.guid)
+        assert upload.state == states.DONE
+
+        # Cleanup file
+        upload.delete()
+
+    def test_send_received_signal_missing_upload(self):
+        # Errors in the background thread are logged, instead of getting lost
+        with self.assertLogs('rest_framework_tus.views', level='ERROR') as logs:
+            views.send_received_signal(-1)
+
+        assert 'Unable to send the received signal for upload -1' in logs.output[0]
+
+    def test_upload_buffer_chunks(self):
+        validated = []
+
+        class UploadViewSet(views.UploadViewSet):
+            buffer_chunks = True
+
+            def validate_chunk(self, offset, chunk_bytes):
+                validated.append((offset, chunk_bytes))
+                return super(UploadViewSet, self).validate_chunk(offset, chunk_bytes)
+
+        # Create upload
+        upload = UploadFactory(
+            filename='test_data.txt', upload_metadata=json.dumps({'filename': 'test_data.txt'}), upload_length=100)
+
+        # Prepare request
+        request = APIRequestFactory().patch(
+            reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': upload.guid}), data=b'1234',
+            content_type='application/offset+octet-stream', HTTP_TUS_RESUMABLE=tus_api_version,
+            HTTP_UPLOAD_OFFSET='0')
+        TusMiddleware().process_request(request)
+
+        # Perform request
+        result = UploadViewSet.as_view({'patch': 'partial_update'})(request, guid=str(upload.guid))
+
+        # Check result
+        assert result.status_code == status.HTTP_204_NO_CONTENT
+        assert validated == [(0, b'1234')]
+
+        # Cleanup file
+        get_upload_model().objects.get(guid=upload.guid).delete()
+
+    def test_upload_invalid_content_type(self):
+        # Create upload
+        upload = UploadFactory(
+            filename='test_data.txt', upload_metadata=json.dumps({'filename': 'test_data.txt'}), upload_length=100)
+
+        # Prepare headers
+        headers = {
+            'Tus-Resumable': tus_api_version,
+            'Upload-Offset': 0,
+        }
+
+        # Perform requests, with and without data
+        for data in (b'1234', b''):
+            result = self.client.patch(
+                reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': upload.guid}), data=data,
+                headers=headers, content_type='application/octet-stream')
+
+            # Check result
+            assert result.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+        # Make sure the upload has not been touched
+        upload = get_upload_model().objects.get(guid=upload.guid)
+        assert upload.upload_offset == 0
+        assert upload.temporary_file_path is None
+
+    def test_upload_content_type_of_other_parser(self):
+        view = views.UploadViewSet.as_view(
+            {'patch': 'partial_update'}, parser_classes=[TusUploadStreamParser, JSONParser])
+
+        # Create upload
+        upload = UploadFactory(
+            filename='test_data.txt', upload_metadata=json.dumps({'filename': 'test_data.txt'}), upload_length=100)
+
+        # Prepare request
+        request = APIRequestFactory().patch(
+            reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': upload.guid}), data=b'{}',
+            content_type='application/json', HTTP_TUS_RESUMABLE=tus_api_version, HTTP_UPLOAD_OFFSET='0')
+        TusMiddleware().process_request(request)
+
+        # Perform request
+        result = view(request, guid=str(upload.guid))
+
+        # Check result
+        assert result.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+    def test_upload_without_stream_parser(self):
+        view = views.UploadViewSet.as_view({'patch': 'partial_update'}, parser_classes=[])
+
+        # Create upload
+        upload = UploadFactory(
+            filename='test_data.txt', upload_metadata=json.dumps({'filename': 'test_data.txt'}), upload_length=100)
+
+        def patch(content_type):
+            request = APIRequestFactory().patch(
+                reverse('rest_framework_tus:api:upload-detail', kwargs={'guid': upload.guid}), data=b'1234',
+                content_type=content_type, HTTP_TUS_RESUMABLE=tus_api_version, HTTP_UPLOAD_OFFSET='0')
+            TusMiddleware().process_request(request)
+            return view(request, guid=str(upload.guid))
+
+        # The content type is still validated
+        assert patch('application/octet-stream').status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        assert patch('application/offset+octet-stream').status_code == status.HTTP_204_NO_CONTENT
+
+        # Make sure the chunk has been written
+        upload = get_upload_model().objects.get(guid=upload.guid)
+        assert upload.upload_offset == 4
+
+        # Cleanup file
+        upload.delete()
+
     def test_upload_without_checksum(self):
         self._test_upload_with_checksum(None)
 
@@ -274,6 +506,10 @@ class ViewTests(APITestCase):
             if expected_failure:
                 assert result.status_code == expected_failure
 
+                # Make sure the chunk has not been accepted
+                upload = get_upload_model().objects.get(guid=upload.guid)
+                assert upload.upload_offset == upload_offset
+
                 # Cleanup file
                 upload.delete()
 
@@ -0,0 +1,11 @@
+# -*- coding: utf-8
+from __future__ import unicode_literals, absolute_import
+
+from django.conf.urls.i18n import i18n_patterns
+from django.urls import re_path, include
+
+from rest_framework_tus.urls import urlpatterns as rest_framework_tus_urls
+
+urlpatterns = i18n_patterns(
+    re_path(r'^', include((rest_framework_tus_urls, 'rest_framework_tus'), namespace='rest_framework_tus')),
+)